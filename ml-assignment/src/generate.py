@@ -8,7 +8,8 @@ def main():
     with open("data/example_corpus.txt", "r") as f:
         text = f.read()
 
-    model.fit(text)
+    # Reuse the counts from a previous run on the same corpus
+    model.fit_cached(text)
 
     # Generate new text
     generated_text = model.generate()
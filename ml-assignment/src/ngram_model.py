@@ -1,113 +1,359 @@
+import os
 import re
+import pickle
 import random
-from collections import Counter, defaultdict
+import hashlib
+import bisect
+import itertools
+from collections import defaultdict
+from functools import partial
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # optional: only needed for TrigramModel(jit=True)
+    njit = None
 
 SENT_START = "<s>"
 SENT_END = "</s>"
 
-# tokens: words (including contractions/numbers) and sentence-ending punctuation
-_TOKEN_RE = re.compile(r"[A-Za-z0-9']+|[.!?]")
+# tokens: words (including contractions/numbers) and sentence-ending punctuation.
+# Both cases are matched so only the matched words need lowercasing, not the whole text.
+_TOKEN_RE = re.compile(r"[A-Za-z0-9']+|[.!?]", re.ASCII)
+
+# word ids: the padding symbols are always interned first
+_START_ID = 0
+_END_ID = 1
+_ID_BITS = 32
+_ID_MASK = (1 << _ID_BITS) - 1
+
+
+def _pack(w1: int, w2: int) -> int:
+    """Pack a (w1, w2) id pair into a single int dict key."""
+    return (w1 << _ID_BITS) | w2
+
+
+# contexts with at least this many distinct continuations get an alias table
+_ALIAS_MIN_SIZE = 16
+
+
+def _build_alias(weights):
+    """
+    Walker/Vose alias tables for a list of non-negative weights.
+    Returns (prob, alias): draw i uniformly, keep it with probability prob[i],
+    otherwise take alias[i].
+    """
+    n = len(weights)
+    total = sum(weights)
+    scaled = [w * n / total for w in weights]
+    prob = [1.0] * n
+    alias = list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+    # leftovers are 1.0 up to float rounding
+    return prob, alias
+
+
+def _generate_ids(tri_keys, bi_keys, uni_row, indptr, word_ids, cum, max_length, seed):
+    """
+    Generation loop over the CSR tables built by TrigramModel._freeze.
+    Rows are looked up by binary search on the sorted trigram keys, then the
+    bigram keys (w2), then the unigram row; the next word is found by binary
+    search on the row's slice of the (global) cumulative weights.
+    Compiled with numba when available.
+    """
+    np.random.seed(seed)
+    out = np.empty(max_length, dtype=np.int64)
+    n = 0
+    w1 = _START_ID
+    w2 = _START_ID
+    n_tri = tri_keys.size
+    for _ in range(max_length):
+        key = (w1 << _ID_BITS) | w2
+        j = np.searchsorted(tri_keys, key)
+        if j < n_tri and tri_keys[j] == key:
+            row = j
+        else:
+            j = np.searchsorted(bi_keys, w2)
+            if j < bi_keys.size and bi_keys[j] == w2:
+                row = n_tri + j
+            elif uni_row >= 0:
+                row = uni_row
+            else:
+                break
+        lo = indptr[row]
+        hi = indptr[row + 1]
+        base = cum[lo - 1] if lo > 0 else 0.0
+        target = base + np.random.random() * (cum[hi - 1] - base)
+        # search [lo, hi - 1) so float rounding can never step past the row
+        next_id = word_ids[lo + np.searchsorted(cum[lo:hi - 1], target, side="right")]
+        if next_id == _END_ID:
+            break
+        out[n] = next_id
+        n += 1
+        w1 = w2
+        w2 = next_id
+    return out[:n]
+
+
+_generate_ids_jit = njit(cache=True)(_generate_ids) if njit is not None else None
 
 
 class TrigramModel:
-    def __init__(self, seed: int = 42):
+    # no per-instance __dict__: smaller instances, faster attribute access
+    __slots__ = (
+        "counts",
+        "bigram_counts",
+        "unigram_counts",
+        "_random",
+        "_rng",
+        "_id",
+        "_words",
+        "_jit",
+        "_csr",
+        "_dist_cache",
+        "_row_samplers",
+    )
+
+    def __init__(self, seed: int = 42, jit: bool = False):
         """
-        Trigram model:
-          - self.counts: (w1, w2) -> Counter(next_word -> count)
-          - self.bigram_counts: w2 -> Counter(next_word -> count)  (for backoff)
-          - self.unigram_counts: Counter(word -> count)           (final fallback)
+        Trigram model (all words are interned to integer ids):
+          - self.counts: pack(w1, w2) -> {next_word: count}
+          - self.bigram_counts: w2 -> {next_word: count}  (for backoff)
+          - self.unigram_counts: {word: count}           (final fallback)
+        Plain int dicts are used rather than Counter: cheaper per increment.
+
+        jit=True runs generate() through the numba-compiled loop; it pays a
+        one-off compile on first use, so it only helps long or repeated generation.
         """
-        self.counts = defaultdict(Counter)       # (w1, w2) -> Counter(next_word)
-        self.bigram_counts = defaultdict(Counter)  # w2 -> Counter(next_word)
-        self.unigram_counts = Counter()
+        if jit and _generate_ids_jit is None:
+            raise ImportError("TrigramModel(jit=True) requires the 'numba' package")
+        self._jit = jit
+        self.counts = defaultdict(partial(defaultdict, int))         # pack(w1, w2) -> {next_word: count}
+        self.bigram_counts = defaultdict(partial(defaultdict, int))  # w2 -> {next_word: count}
+        self.unigram_counts = defaultdict(int)
         self._random = random.Random(seed)
+        self._rng = np.random.default_rng(seed)  # for batched numpy draws
 
-    # ----------------- tokenization & sentence split -----------------
-    def _tokenize(self, text: str):
-        # Lowercase + regex tokenization; keep .,!,? tokens so we can split sentences
-        text = text.lower()
-        tokens = _TOKEN_RE.findall(text)
-        return tokens
-
-    def _split_sentences(self, tokens):
-        sentences = []
-        cur = []
-        for t in tokens:
-            cur.append(t)
-            if t in ('.', '!', '?'):
-                # End of sentence: remove the punctuation tokens from sentence words
-                sentences.append([tok for tok in cur if tok not in ('.', '!', '?')])
-                cur = []
-        if cur:
-            # leftover tokens (no terminating punctuation) still considered a sentence
-            sentences.append([tok for tok in cur if tok not in ('.', '!', '?')])
-        return sentences
+        # Vocabulary: word -> id and id -> word
+        self._id = {}
+        self._words = []
+        self._reset_vocab()
+
+        # Frozen CSR sampling table built at the end of fit(), see _freeze()
+        self._csr = None
+        # Distribution caches (cleared by fit): context -> sampler, CSR row -> sampler
+        self._dist_cache = {}
+        self._row_samplers = {}
+        self._freeze()
+
+    # ----------------- vocabulary -----------------
+    def _reset_vocab(self):
+        self._id = {SENT_START: _START_ID, SENT_END: _END_ID}
+        self._words = [SENT_START, SENT_END]
+
+    def _id_of(self, w: str) -> int:
+        """Return the id for w, assigning a fresh one on first sight."""
+        i = self._id.get(w)
+        if i is None:
+            i = self._id[w] = len(self._words)
+            self._words.append(w)
+        return i
 
     # ----------------- training -----------------
     def fit(self, text: str):
         """
         Train the trigram model on the given raw text.
-        - Tokenize, split into sentences
-        - Pad each sentence with two <s> and one </s>
+        Single pass over the regex matches:
+        - Regex tokenization, lowercasing each word; .,!,? end the current sentence
+        - Each sentence is implicitly padded with two <s> and one </s>
+          via a rolling (w1, w2) window
         - Build trigram counts, bigram counts (for backoff), and unigram counts
         """
-        tokens = self._tokenize(text)
-        sentences = self._split_sentences(tokens)
-
         # Clear previous counts (allow re-fit)
         self.counts.clear()
         self.bigram_counts.clear()
         self.unigram_counts.clear()
+        self._reset_vocab()
+        # locals for the per-token loop
+        id_of = self._id_of
+        counts = self.counts
+        bigram_counts = self.bigram_counts
+        unigram_counts = self.unigram_counts
 
-        for sent in sentences:
-            if not sent:
+        w1 = w2 = _START_ID
+        for m in _TOKEN_RE.finditer(text):
+            t = m.group()
+            # chained == beats a frozenset probe here: every match is a fresh
+            # string, so a set lookup would hash it first
+            if t == '.' or t == '!' or t == '?':
+                # End of sentence (empty sentences are skipped)
+                if w2 != _START_ID:
+                    counts[(w1 << _ID_BITS) | w2][_END_ID] += 1
+                    bigram_counts[w2][_END_ID] += 1
+                    unigram_counts[_END_ID] += 1
+                    w1 = w2 = _START_ID
                 continue
-            padded = [SENT_START, SENT_START] + sent + [SENT_END]
 
-            # Update unigram counts (exclude artificial start tokens)
-            for w in padded:
-                if w != SENT_START:
-                    self.unigram_counts[w] += 1
+            w3 = id_of(t.lower())
+            counts[(w1 << _ID_BITS) | w2][w3] += 1
+            # Bigram context for backoff: store under w2 -> {next_word: count}
+            bigram_counts[w2][w3] += 1
+            unigram_counts[w3] += 1
+            w1, w2 = w2, w3
 
-            # Update trigram & bigram counts
-            for i in range(len(padded) - 2):
-                context = (padded[i], padded[i + 1])  # (w1, w2)
-                next_word = padded[i + 2]
-                self.counts[context][next_word] += 1
-                # Bigram context for backoff: store under w2 -> Counter(next_word)
-                self.bigram_counts[context[1]][next_word] += 1
+        if w2 != _START_ID:
+            # leftover tokens (no terminating punctuation) still considered a sentence
+            counts[(w1 << _ID_BITS) | w2][_END_ID] += 1
+            bigram_counts[w2][_END_ID] += 1
+            unigram_counts[_END_ID] += 1
 
-    # ----------------- generation -----------------
-    def _sample_from_counter(self, counter: Counter):
-        """Sample a key from a Counter proportionally to counts."""
-        if not counter:
-            return SENT_END
-        words, weights = zip(*counter.items())
-        return self._random.choices(words, weights=weights, k=1)[0]
+        self._freeze()
+
+    # fitted state saved by fit_cached(); bump _CACHE_FORMAT whenever the layout
+    # of these fields (id packing, tokenization, count containers) changes
+    _CACHED_FIELDS = ("counts", "bigram_counts", "unigram_counts", "_id", "_words")
+    _CACHE_FORMAT = 1
 
-    def _backoff_sample(self, context):
+    def fit_cached(self, text: str, cache_dir: str = ".cache"):
         """
-        Backoff sampling:
+        Like fit(), but reuse counts pickled on disk for the same corpus.
+        The cache file is keyed by the SHA-1 of the text and the cache format version.
+        """
+        key = f"{hashlib.sha1(text.encode()).hexdigest()}-v{self._CACHE_FORMAT}"
+        path = os.path.join(cache_dir, f"{key}.pkl")
+
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+            for name in self._CACHED_FIELDS:
+                setattr(self, name, state[name])
+            self._freeze()
+            return
+
+        self.fit(text)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({name: getattr(self, name) for name in self._CACHED_FIELDS}, f)
+        os.replace(tmp_path, path)
+
+    def _freeze(self):
+        """
+        Flatten all distributions into one contiguous CSR table, stored as
+        self._csr = (tri_keys, bi_keys, uni_row, indptr, word_ids, cum_weights):
+          - rows are the sorted trigram contexts, then the sorted bigram
+            contexts (w2), then the unigram distribution (uni_row, -1 if untrained)
+          - row r holds word_ids[indptr[r]:indptr[r + 1]], with a running
+            (global) cumulative sum of their counts in cum_weights
+        All sampling reads this table in place; the count dicts are kept as
+        the public training-side state (re-fit, fit_cached).
+        """
+        tri_keys = sorted(self.counts)
+        bi_keys = sorted(self.bigram_counts)
+        rows = [self.counts[k] for k in tri_keys] + [self.bigram_counts[k] for k in bi_keys]
+        uni_row = len(rows) if self.unigram_counts else -1
+        if self.unigram_counts:
+            rows.append(self.unigram_counts)
+
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(r) for r in rows], out=indptr[1:])
+        total = int(indptr[-1])
+        word_ids = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64, count=total)
+        weights = np.fromiter(
+            itertools.chain.from_iterable(r.values() for r in rows), dtype=np.float64, count=total
+        )
+        self._csr = (
+            np.array(tri_keys, dtype=np.int64),
+            np.array(bi_keys, dtype=np.int64),
+            uni_row,
+            indptr,
+            word_ids,
+            np.cumsum(weights),
+        )
+        self._dist_cache = {}
+        self._row_samplers = {}
+
+    def _resolve_row(self, context) -> int:
+        """
+        Backoff: CSR row for a packed (w1, w2) context, or -1 if the model is untrained.
           1) Try trigram context (w1, w2)
           2) If unseen, try bigram context w2
           3) If still unseen, use unigram distribution
-          4) If model untrained, return SENT_END
         """
-        # 1) trigram
-        if context in self.counts and len(self.counts[context]) > 0:
-            return self._sample_from_counter(self.counts[context])
+        tri_keys, bi_keys, uni_row = self._csr[:3]
+        j = int(np.searchsorted(tri_keys, context))
+        if j < tri_keys.size and tri_keys[j] == context:
+            return j
+        w2 = context & _ID_MASK
+        j = int(np.searchsorted(bi_keys, w2))
+        if j < bi_keys.size and bi_keys[j] == w2:
+            return tri_keys.size + j
+        return uni_row
 
-        # 2) bigram backoff (w2)
-        w2 = context[1]
-        if w2 in self.bigram_counts and len(self.bigram_counts[w2]) > 0:
-            return self._sample_from_counter(self.bigram_counts[w2])
+    def _row_bounds(self, row):
+        """
+        (lo, hi, base, span) of a CSR row: its entries are [lo, hi) and its
+        cumulative weights run from base (exclusive) to base + span.
+        """
+        indptr, cum = self._csr[3], self._csr[5]
+        lo, hi = int(indptr[row]), int(indptr[row + 1])
+        base = float(cum[lo - 1]) if lo > 0 else 0.0
+        return lo, hi, base, float(cum[hi - 1]) - base
 
-        # 3) unigram fallback
-        if self.unigram_counts:
-            return self._sample_from_counter(self.unigram_counts)
+    # ----------------- generation -----------------
+    def _sample_bisect(self, word_ids, cum, lo, last, base, span):
+        """Sample from a CSR row by bisecting its slice of the cumulative weights."""
+        # search [lo, last) with last = hi - 1 so float rounding can never step past the row
+        return word_ids.item(bisect.bisect(cum, base + self._random.random() * span, lo, last))
+
+    def _sample_alias(self, word_ids, lo, prob, alias):
+        """Sample from a CSR row through its Walker alias tables (many continuations)."""
+        # one uniform gives both the column and the coin flip
+        u = self._random.random() * len(prob)
+        i = int(u)
+        return word_ids.item(lo + (i if u - i < prob[i] else alias[i]))
+
+    def _get_sampler(self, context):
+        """
+        Zero-arg sampler for a packed (w1, w2) context.
+        The sampler wraps the resolved distribution, never a sampled token:
+        backoff runs once per distinct context, and contexts that back off
+        to the same CSR row share one sampler.
+        """
+        sampler = self._dist_cache.get(context)
+        if sampler is None:
+            row = self._resolve_row(context)
+            sampler = self._row_samplers.get(row)
+            if sampler is None:
+                sampler = self._row_samplers[row] = self._make_sampler(row)
+            self._dist_cache[context] = sampler
+        return sampler
 
-        # Nothing available
-        return SENT_END
+    def _make_sampler(self, row):
+        """
+        Zero-arg sampler over the word ids of a CSR row (-1: untrained model,
+        always returns SENT_END). Draws read the CSR arrays in place:
+          - few continuations: bisect over the row's cumulative weights
+          - many continuations: Walker alias tables (O(1) draw), the only
+            per-row data built on the side
+        """
+        if row < 0:
+            # Nothing available
+            return lambda: _END_ID
+        word_ids, cum = self._csr[4], self._csr[5]
+        lo, hi, base, span = self._row_bounds(row)
+        if hi - lo >= _ALIAS_MIN_SIZE:
+            prob, alias = _build_alias(np.diff(cum[lo:hi], prepend=base).tolist())
+            return partial(self._sample_alias, word_ids, lo, prob, alias)
+        return partial(self._sample_bisect, word_ids, cum, lo, hi - 1, base, span)
 
     def generate(self, max_length=50) -> str:
         """
@@ -115,22 +361,83 @@ class TrigramModel:
         - Start from (<s>, <s>)
         - Sample next words until </s> or max_length
         - Return detokenized string
+        Uses the numba-compiled loop if the model was built with jit=True.
         """
-        context = (SENT_START, SENT_START)
+        if self._jit:
+            ids = _generate_ids_jit(*self._csr, max_length, self._random.getrandbits(32))
+            words = self._words
+            return self._detokenize([words[i] for i in ids.tolist()])
+
+        context = _pack(_START_ID, _START_ID)
         output_tokens = []
+        # locals for the per-token loop
+        cached = self._dist_cache.get
+        get_sampler = self._get_sampler
+        words = self._words
+        append = output_tokens.append
 
         for _ in range(max_length):
-            next_word = self._backoff_sample(context)
-            if next_word == SENT_END:
+            next_id = (cached(context) or get_sampler(context))()
+            if next_id == _END_ID:
                 break
-            output_tokens.append(next_word)
-            context = (context[1], next_word)
+            append(words[next_id])
+            context = ((context & _ID_MASK) << _ID_BITS) | next_id
+
+        return self._detokenize(output_tokens)
 
-        if not output_tokens:
+    def _detokenize(self, tokens) -> str:
+        if not tokens:
             return ""
 
-        text = " ".join(output_tokens)
+        text = " ".join(tokens)
         # Capitalize first character to look nicer
         if text:
             text = text[0].upper() + text[1:]
         return text
+
+    # ----------------- batch generation -----------------
+    def generate_batch(self, n: int, max_length=50) -> list:
+        """
+        Generate n texts at once.
+        At each step the live sequences are grouped by their (w1, w2) context
+        and all draws for one context are made with a single numpy call
+        (uniforms searched in that context's CSR slice of cumulative weights).
+        Returns a list of n detokenized strings (same format as generate()).
+        """
+        rng = self._rng
+        word_ids, cum = self._csr[4], self._csr[5]
+        out = np.full((n, max_length), _END_ID, dtype=np.int64)
+        ctx = np.full(n, _pack(_START_ID, _START_ID), dtype=np.int64)
+        live = np.arange(n)
+
+        for step in range(max_length):
+            if live.size == 0:
+                break
+            contexts, inverse = np.unique(ctx[live], return_inverse=True)
+            # rows of `live` grouped by context
+            order = np.argsort(inverse, kind="stable")
+            bounds = np.cumsum(np.bincount(inverse, minlength=contexts.size))
+            next_ids = np.full(live.size, _END_ID, dtype=np.int64)
+            lo = 0
+            for c, hi in zip(contexts.tolist(), bounds.tolist()):
+                row = self._resolve_row(c)
+                if row >= 0:
+                    rows = order[lo:hi]
+                    r_lo, r_hi, base, span = self._row_bounds(row)
+                    draws = base + rng.random(rows.size) * span
+                    # search [r_lo, r_hi - 1) so float rounding can never step past the row
+                    next_ids[rows] = word_ids[
+                        r_lo + np.searchsorted(cum[r_lo:r_hi - 1], draws, side="right")
+                    ]
+                lo = hi
+
+            out[live, step] = next_ids
+            ctx[live] = ((ctx[live] & _ID_MASK) << _ID_BITS) | next_ids
+            live = live[next_ids != _END_ID]
+
+        words = self._words
+        texts = []
+        for row in out.tolist():
+            end = row.index(_END_ID) if _END_ID in row else max_length
+            texts.append(self._detokenize([words[i] for i in row[:end]]))
+        return texts
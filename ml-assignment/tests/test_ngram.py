@@ -1,26 +1,111 @@
+import numpy as np
 import pytest
-from src.ngram_model import TrigramModel
+from src.ngram_model import TrigramModel, _build_alias, _generate_ids, _generate_ids_jit
 
-def test_fit_and_generate():
-    model = TrigramModel()
+# run generation tests on both the pure-Python sampler and the numba loop
+JIT_MODES = [
+    False,
+    pytest.param(True, marks=pytest.mark.skipif(_generate_ids_jit is None, reason="numba not installed")),
+]
+
+@pytest.mark.parametrize("jit", JIT_MODES)
+def test_fit_and_generate(jit):
+    model = TrigramModel(jit=jit)
     text = "I am a test sentence. This is another test sentence."
     model.fit(text)
     generated_text = model.generate()
     assert isinstance(generated_text, str)
     assert len(generated_text.split()) > 0
 
-def test_empty_text():
-    model = TrigramModel()
+@pytest.mark.parametrize("jit", JIT_MODES)
+def test_empty_text(jit):
+    model = TrigramModel(jit=jit)
     text = ""
     model.fit(text)
     generated_text = model.generate()
     assert generated_text == ""
 
-def test_short_text():
-    model = TrigramModel()
+@pytest.mark.parametrize("jit", JIT_MODES)
+def test_short_text(jit):
+    model = TrigramModel(jit=jit)
     text = "I am."
     model.fit(text)
     generated_text = model.generate()
     assert isinstance(generated_text, str)
 
 
+@pytest.mark.parametrize("jit", JIT_MODES)
+def test_many_continuations(jit):
+    model = TrigramModel(jit=jit)
+    # one context followed by many different words; with jit=False this
+    # goes through the alias sampler
+    text = " ".join(f"the cat w{i}." for i in range(40))
+    model.fit(text)
+    for _ in range(20):
+        words = model.generate().lower().split()
+        assert words[:2] == ["the", "cat"]
+        assert words[2].startswith("w")
+
+def test_build_alias():
+    weights = [5, 1, 1, 3, 7, 2, 2, 9, 1, 4, 6, 1, 1, 8, 2, 3, 5]
+    prob, alias = _build_alias(weights)
+    n = len(weights)
+    # column i keeps prob[i] of its 1/n share and gives the rest to alias[i]
+    implied = [p / n for p in prob]
+    for i, p in enumerate(prob):
+        implied[alias[i]] += (1.0 - p) / n
+    total = sum(weights)
+    assert implied == pytest.approx([w / total for w in weights], abs=1e-12)
+
+def test_generate_batch():
+    model = TrigramModel()
+    text = "I am a test sentence. This is another test sentence."
+    model.fit(text)
+    texts = model.generate_batch(8, max_length=10)
+    assert len(texts) == 8
+    for t in texts:
+        assert isinstance(t, str)
+        assert 0 < len(t.split()) <= 10
+
+    model.fit("")
+    assert model.generate_batch(3) == ["", "", ""]
+
+def test_generate_ids_stays_in_row():
+    # the unigram row sits between rows whose cumulative weights are ~2**52,
+    # where float rounding can push the draw onto the row's last boundary
+    csr = (
+        np.array([7], dtype=np.int64),      # tri_keys: (<s>, <s>) is unseen
+        np.array([], dtype=np.int64),       # bi_keys
+        1,                                  # uni_row
+        np.array([0, 1, 2, 3], dtype=np.int64),
+        np.array([5, 2, 3], dtype=np.int64),
+        np.array([2.0**52, 2.0**52 + 1, 2.0**52 + 2]),
+    )
+    loops = [_generate_ids] + ([_generate_ids_jit] if _generate_ids_jit is not None else [])
+    for loop in loops:
+        for seed in range(50):
+            assert loop(*csr, 1, seed).tolist() == [2]
+
+def test_fit_cached(tmp_path):
+    text = "I am a test sentence. This is another test sentence."
+    first = TrigramModel()
+    first.fit_cached(text, cache_dir=str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+
+    second = TrigramModel()
+    second.fit_cached(text, cache_dir=str(tmp_path))
+    assert second.counts == first.counts
+    assert second.generate() == first.generate()
+
+def test_fit_cached_format_version(tmp_path, monkeypatch):
+    text = "I am a test sentence. This is another test sentence."
+    TrigramModel().fit_cached(text, cache_dir=str(tmp_path))
+
+    # a layout change must not load the older pickle
+    monkeypatch.setattr(TrigramModel, "_CACHE_FORMAT", TrigramModel._CACHE_FORMAT + 1)
+    model = TrigramModel()
+    model.fit_cached(text, cache_dir=str(tmp_path))
+    names = sorted(p.name for p in tmp_path.iterdir())
+    assert len(names) == 2
+    assert sum(name.endswith(f"-v{TrigramModel._CACHE_FORMAT}.pkl") for name in names) == 1
+    assert isinstance(model.generate(), str)